@@ -1,12 +1,9 @@
-import glob
 import logging
-import sys
 from datetime import datetime
 
 import beancount.parser.printer
 import click
 import os
-import io
 
 import boekhouder.importer
 from boekhouder.data import Repository
@@ -29,7 +26,6 @@ def bh_args(callback):
         logging.basicConfig(level=level)
 
         # Create repo
-        import inspect
 
         return callback(**kwargs)
     
@@ -57,17 +53,20 @@ def init():
 @click.option("--verbose", "-v", is_flag=True)
 @click.option("--dry-run", "-n", is_flag=True)
 def cmd_import(verbose, dry_run):
-    repo = Repository()
+    # import only needs transaction references
+    repo = Repository(full=False)
     repo.load_extracts()
 
-    bc_txns = set(repo.bc_txn_map)
-    xl_txns = set(repo.xl_txn_map)
-    if bc_txns - xl_txns:
+    # Key views support set operations directly, without copying either map's keys
+    bc_txns = repo.bc_txn_map.keys()
+    xl_txns = repo.xl_txn_map.keys()
+    missing_txn_ids = bc_txns - xl_txns
+    if missing_txn_ids:
         click.echo("WARNING: Transactions in ledger not found in extracts", err=not verbose)
         if not verbose:
             click.echo("Pass -v for details", err=True)
         else:
-            for txnid in bc_txns - xl_txns:
+            for txnid in missing_txn_ids:
                 txn = repo.bc_txn_map[txnid]
                 click.echo(f" - {txn.date} - {txnid} {txn.narration})")
 
@@ -77,12 +76,8 @@ def cmd_import(verbose, dry_run):
     if not new_txn_ids:
         click.echo("No new transactions found", err=True)
         return
-    processed = set()
-    for txn in new_txn_ids:
-        txn = repo.xl_txn_map[txn]
-        if txn.reference in processed:
-            continue
-        processed.add(txn.reference)
+    for txnid in new_txn_ids:
+        txn = repo.xl_txn_map[txnid]
         for filter in repo.config.get("filters", []):
             if filter.test(txn):
                 handler = filter.handler
@@ -95,9 +90,17 @@ def cmd_import(verbose, dry_run):
         beancount.parser.printer.print_entries(new_txns)
     else:
         date = datetime.today().strftime("%Y-%m-%d")
+        txn_dir = os.path.join(repo.basedir, "transactions")
+        # Prefixes of existing {date}_{i}_* files
+        taken = {
+            "_".join(parts[:2])
+            for parts in (name.split("_", 2) for name in os.listdir(txn_dir))
+            if len(parts) == 3
+        }
         for i in range(1,1000):
-            base = os.path.join(repo.basedir, "transactions", f"{date}_{i:03d}")
-            if not glob.glob(base + "_*"):
+            prefix = f"{date}_{i:03d}"
+            if prefix not in taken:
+                base = os.path.join(txn_dir, prefix)
                 break
         else:
             logging.error("Unable to create a new file for the new records")
@@ -112,7 +115,7 @@ def cmd_import(verbose, dry_run):
             beancount.parser.printer.print_entries(auto_entries, file=f)
         with open(manual_file, "wt") as f:
             beancount.parser.printer.print_entries(manual_entries, file=f)
-        repo.scan_beancount()
+        repo.include_beancount(auto_file, manual_file)
         click.echo("TODOs:")
         if auto_entries:
             click.echo(f" - check {auto_file} for accuracy")
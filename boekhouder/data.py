@@ -1,30 +1,32 @@
 import logging
 import os.path
+import pickle
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from typing import Union, List, Any
 
 import beancount.loader
+import beancount.parser.parser
 import beancount.parser.printer
-import re2
 import yaml
 from beancount.core import data as bc_data
 from dataclasses import dataclass
 from datetime import date
 from . import importer
-import openpyxl
 
-StrFilter = Union[str, re2._Regexp]
+StrFilter = Union[str, re.Pattern]
 
 
-# Configure regex loader
-class ConfigLoader(yaml.SafeLoader):
+# Configure regex loader; prefer the libyaml-backed loader when PyYAML was built with it
+class ConfigLoader(yaml.CSafeLoader if yaml.__with_libyaml__ else yaml.SafeLoader):
     pass
 
 
 def construct_regex(_, node):
     if isinstance(node, yaml.ScalarNode):
-        return re2.compile(node.value)
+        return re.compile(node.value)
 
 
 ConfigLoader.add_constructor("!regex", construct_regex)
@@ -61,26 +63,73 @@ class Repository:
 
     basedir: str
 
-    def __init__(self, basedir=os.path.curdir):
+    def __init__(self, basedir=os.path.curdir, full=True):
         self.basedir = basedir
         self.config = {}
         self.load_config()
         # We always want to load the beancount data
         self.scan_beancount()
-        ledger_data, errors, options = beancount.loader.load_file(os.path.join(basedir, "ledger.beancount"))
+        self.bc_ledger = self.load_beancount(full)
+        # Compute transaction map
+        self.bc_txn_map = {
+            directive.meta["reference"]: directive
+            for directive in self.bc_ledger
+            if directive.__class__ is bc_data.Transaction and "reference" in directive.meta
+        }
+        self.bc_loaded = True
+        self.xl_loaded = False
+
+    def load_beancount(self, full=True) -> List[bc_data.Directive]:
+        """Load the ledger; without `full`, reuse a fresh beancount cache or else only parse it"""
+        ledger_file = os.path.join(self.basedir, "ledger.beancount")
+        if not full:
+            ledger_data = self.read_beancount_cache(ledger_file)
+            if ledger_data is not None:
+                return ledger_data
+            return self.parse_beancount(ledger_file)
+        ledger_data, errors, options = beancount.loader.load_file(ledger_file)
         if errors:
             beancount.parser.printer.print_errors(errors, file=sys.stderr)
             raise Exception("Unable to load beancount file")
-        self.bc_ledger = ledger_data
-        # Compute transaction map
-        self.bc_txn_map = {}
-        for directive in self.bc_ledger:
-            if type(directive) is not bc_data.Transaction:
+        return ledger_data
+
+    @staticmethod
+    def read_beancount_cache(ledger_file: str) -> List[bc_data.Directive] | None:
+        """The entries in beancount's loader cache for this ledger, if it exists and is up to date"""
+        pattern = os.getenv("BEANCOUNT_LOAD_CACHE_FILENAME") or beancount.loader.PICKLE_CACHE_FILENAME
+        cache_file = beancount.loader.get_cache_filename(pattern, ledger_file)
+        try:
+            with open(cache_file, "rb") as f:
+                ledger_data, errors, options = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.info(f"Ignoring unusable ledger cache {cache_file}: {e}")
+            return None
+        if errors or beancount.loader.needs_refresh(options):
+            return None
+        logging.debug(f"Loaded ledger from {cache_file}")
+        return ledger_data
+
+    @staticmethod
+    def parse_beancount(ledger_file: str) -> List[bc_data.Directive]:
+        entries = []
+        errors = []
+        seen = set()
+        pending = [os.path.abspath(ledger_file)]
+        while pending:
+            path = pending.pop()
+            if path in seen:
                 continue
-            if "reference" in directive.meta:
-                self.bc_txn_map[directive.meta["reference"]] = directive
-        self.bc_loaded = True
-        self.xl_loaded = False
+            seen.add(path)
+            file_entries, file_errors, options = beancount.parser.parser.parse_file(path)
+            entries.extend(file_entries)
+            errors.extend(file_errors)
+            pending.extend(os.path.join(os.path.dirname(path), include) for include in options["include"])
+        if errors:
+            beancount.parser.printer.print_errors(errors, file=sys.stderr)
+            raise Exception("Unable to parse beancount file")
+        return entries
 
     def load_config(self):
         fname = os.path.join(self.basedir, "config.yaml")
@@ -95,13 +144,24 @@ class Repository:
         logging.info(f"Loading extracts from {xl_dir}")
         self.xl_txns = []
         self.xl_txn_map = {}
-        for fname in os.listdir(xl_dir):
-            path = os.path.join(xl_dir, fname)
-            txns = importer.import_file(path)
+        # Sorted, so that "later" below means later in file name order
+        paths = [os.path.join(xl_dir, fname) for fname in sorted(os.listdir(xl_dir))]
+        # Files are independent and mostly spent in I/O and calamine's native decoding, so read them concurrently
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+            results = list(executor.map(importer.import_file, paths))
+        for txns in results:
+            if txns is None:
+                # import_file skips files it does not recognise
+                continue
             self.xl_txns.extend(txns)
             for txn in txns:
-                if txn.reference:
-                    self.xl_txn_map[txn.reference] = txn
+                if not txn.reference:
+                    continue
+                # Overlapping extracts repeat transactions; only differing records under one reference are suspect
+                existing = self.xl_txn_map.get(txn.reference)
+                if existing is not None and existing != txn:
+                    logging.warning(f"Conflicting records for reference {txn.reference}; using the later one")
+                self.xl_txn_map[txn.reference] = txn
 
             # TODO: keep track of date ranges in each file and warn when no overlap
 
@@ -110,7 +170,18 @@ class Repository:
 
     def scan_beancount(self):
         txn_dir = os.path.join(self.basedir, "transactions")
-        with open(os.path.join(self.basedir, "ledger.beancount"), "wt") as f:
-            for name in sorted(os.listdir(txn_dir)):
-                print(f'include "transactions/{name}"', file=f)
-
+        ledger_file = os.path.join(self.basedir, "ledger.beancount")
+        body = "".join(f'include "transactions/{name}"\n' for name in sorted(os.listdir(txn_dir)))
+        try:
+            with open(ledger_file, "rt") as f:
+                if f.read() == body:
+                    return
+        except FileNotFoundError:
+            pass
+        with open(ledger_file, "wt") as f:
+            f.write(body)
+
+    def include_beancount(self, *paths):
+        """Append includes for newly written transaction files without rescanning the directory"""
+        with open(os.path.join(self.basedir, "ledger.beancount"), "at") as f:
+            f.write("".join(f'include "transactions/{os.path.basename(path)}"\n' for path in paths))
@@ -1,18 +1,34 @@
-import abc
 import dataclasses
 import logging
 import os
+import re
+from datetime import datetime
 from decimal import Decimal
-from typing import Iterator
+from functools import lru_cache
 
 import beancount.core.data
 from beancount.core.data import Posting
-import polars as pl
-import re2
 from beancount.core.amount import Amount
+from python_calamine import CalamineWorkbook
 
 from boekhouder.data import StrFilter, XlTransaction
 
+# Recurring amounts (membership fees, subscriptions) share their posting units. Amount is immutable, so the same
+# instances can appear in many transactions. Keyed on the exact digits: Decimal equality ignores exponent and sign.
+_amount_cache: dict[tuple[tuple, str], tuple[Amount, Amount]] = {}
+
+
+def _amounts(number: Decimal, currency: str) -> tuple[Amount, Amount]:
+    """Return (number, -number) as Amounts in currency"""
+    if type(number) is not Decimal:
+        # e.g. a number from a handler's replacements; equal floats would otherwise share Decimal entries
+        return Amount(number, currency), Amount(-number, currency)
+    key = (number.as_tuple(), currency)
+    amounts = _amount_cache.get(key)
+    if amounts is None:
+        amounts = _amount_cache[key] = (Amount(number, currency), Amount(-number, currency))
+    return amounts
+
 
 class Handler:
     """A handler converts a transaction to beancount"""
@@ -21,7 +37,7 @@ class Handler:
 
     def __init__(self, yaml):
         self.replacements = yaml.get("replace", {})
-        pass
+        self._has_replacements = bool(self.replacements)
 
     def __init_subclass__(cls, **kwargs):
         try:
@@ -37,7 +53,9 @@ class Handler:
         meta = {
             "reference": txn.reference,
         }
-        txn = dataclasses.replace(txn, **self.replacements)
+        if self._has_replacements:
+            txn = dataclasses.replace(txn, **self.replacements)
+        units, neg_units = _amounts(txn.amount, txn.currency)
         tags = set()
         return beancount.core.data.Transaction(
             date=txn.booking_date,
@@ -50,7 +68,7 @@ class Handler:
             postings=[
                 Posting(
                     account=repo.get_account(txn.account),
-                    units=Amount(txn.amount, txn.currency),
+                    units=units,
                     cost=None,
                     price=None,
                     meta={},
@@ -58,7 +76,7 @@ class Handler:
                 ),
                 Posting(
                     account=f"{self.source_type(txn)}:{self.default_source(txn)}",
-                    units=Amount(-txn.amount, txn.currency),
+                    units=neg_units,
                     cost=None,
                     price=None,
                     meta={},
@@ -93,7 +111,7 @@ class Membership(Handler, name="membership"):
     def __init__(self, yaml):
         super().__init__(yaml)
         self.member = yaml["member"]
-        self.monthly_cost = Decimal(yaml.get("monthly_cost", "25.00")).quantize(DEC_2)
+        self.monthly_cost = to_decimal(yaml.get("monthly_cost", "25.00"))
 
     def handle(self, repo, txn: XlTransaction) -> beancount.core.data.Transaction:
         if self.monthly_cost != txn.amount:
@@ -135,6 +153,11 @@ class Filter:
         self.message = self.parse_filter(yaml.get("message", []))
         self.account = self.parse_filter(yaml.get("account", []))
         self.handler = Handler.HANDLERS[yaml.get("handler", None)](yaml)
+        # Precompile each field's patterns: literals become a set, regexes a single alternation where possible
+        self._all_name, self._literals_name, self._regexps_name = self.compile_filter(self.name)
+        self._all_kind, self._literals_kind, self._regexps_kind = self.compile_filter(self.kind)
+        self._all_message, self._literals_message, self._regexps_message = self.compile_filter(self.message)
+        self._all_account, self._literals_account, self._regexps_account = self.compile_filter(self.account)
 
     @staticmethod
     def parse_filter(entries):
@@ -143,23 +166,32 @@ class Filter:
         return [entries]
 
     @staticmethod
-    def _test1(field: str, pattern: list[StrFilter]) -> bool:
-        if len(pattern) == 0:
-            return True
-        for item in pattern:
-            if type(item) is str and item == field:
-                return True
-            if type(item) is re2._Regexp and item.match(field):
-                return True
-        return False
+    def compile_filter(pattern: list[StrFilter]) -> tuple[bool, frozenset[str], tuple[re.Pattern, ...]]:
+        """Split a field's patterns into (matches everything, literals, regexes)"""
+        literals = frozenset(item for item in pattern if type(item) is str)
+        regexps = tuple(item for item in pattern if type(item) is re.Pattern)
+        # Fold several regexes into one alternation, unless they have groups (joining renumbers them, which breaks
+        # backreferences and clashes on reused names) or the result does not compile, e.g. with inline flags (?i)
+        if len(regexps) > 1 and not any(item.groups for item in regexps):
+            try:
+                regexps = (re.compile("|".join(f"(?:{item.pattern})" for item in regexps)),)
+            except re.error:
+                pass
+        return not pattern, literals, regexps
+
+    @staticmethod
+    def _test1(field: str, match_all: bool, literals: frozenset[str], regexps: tuple[re.Pattern, ...]) -> bool:
+        return match_all or field in literals or any(regex.match(field) for regex in regexps)
 
     def test(self, txn: "XlTransaction"):
-        return all([
-            self._test1(txn.message, self.message),
-            self._test1(txn.counterparty_account, self.account),
-            self._test1(txn.counterparty_name, self.name),
-            self._test1(txn.description, self.kind)
-        ])
+        return (
+            self._test1(txn.message, self._all_message, self._literals_message, self._regexps_message)
+            and self._test1(
+                txn.counterparty_account, self._all_account, self._literals_account, self._regexps_account
+            )
+            and self._test1(txn.counterparty_name, self._all_name, self._literals_name, self._regexps_name)
+            and self._test1(txn.description, self._all_kind, self._literals_kind, self._regexps_kind)
+        )
 
 
 def import_file(fname):
@@ -174,50 +206,57 @@ def import_file(fname):
 DEC_2 = Decimal("0.00")
 
 
+def to_decimal(value) -> Decimal:
+    """Convert a number from a sheet or the config to a Decimal with 2 places.
+
+    Goes through str() rather than Decimal.from_float, so floats convert from their shortest repr instead of their
+    exact binary expansion."""
+    return _parse_decimal(str(value))
+
+
+# Keyed on the text: float and bool equality would merge -0.0 with 0.0 and True with 1
+@lru_cache(maxsize=4096)
+def _parse_decimal(text: str) -> Decimal:
+    return Decimal(text).quantize(DEC_2)
+
+
 def import_xl(fname: str):
     log = logging.getLogger("boekhouder.import.import_xl")
-    # Load as XLSX
+    # Load as XLSX; calamine hands back plain Python rows, the first one being the header
     fname = os.path.join(fname)
-    ws = pl.read_excel(
-        fname,
-        sheet_name="Verrichtingen",
-        engine="calamine",
-        read_options={"header_row": 0},
-        schema_overrides={"Bedrag": pl.Decimal(scale=2)}
-    )
-    # doc = fastexcel.read_excel(fname)
-    # doc = openpyxl.load_workbook(fname, read_only=True, data_only=True)
-    # ws = doc.load_sheet("Verrichtingen", header_row=1).to_polars()
+    header, *rows = CalamineWorkbook.from_path(fname).get_sheet_by_name("Verrichtingen").to_python()
     # compute headers
-    id = lambda x: x
-    to_date = lambda x: x.date()
-    to_decimal = lambda x: Decimal.from_float(x).quantize(DEC_2)
+    # calamine returns untyped cells, so numeric-looking text (e.g. a structured message) arrives as a float
+    to_str = lambda x: str(int(x)) if isinstance(x, float) and x.is_integer() else str(x)
+    to_date = lambda x: x.date() if isinstance(x, datetime) else x
     col_assq = {
-        "Rekening": ("account", id),
-        "Boekdatum": ("booking_date", id),
-        "Valutadatum": ("value_date", id),
-        "Referentie": ("reference", id),
-        "Beschrijving": ("description", id),
+        "Rekening": ("account", to_str),
+        "Boekdatum": ("booking_date", to_date),
+        "Valutadatum": ("value_date", to_date),
+        "Referentie": ("reference", to_str),
+        "Beschrijving": ("description", to_str),
         "Bedrag": ("amount", to_decimal),
-        "Munt": ("currency", id),
-        "Verrichtingsdatum": ("value_date", id),
-        "Rekening tegenpartij": ("counterparty_account", id),
-        "Naam tegenpartij": ("counterparty_name", id),
-        "Mededeling": ("message", id),
+        "Munt": ("currency", to_str),
+        "Verrichtingsdatum": ("operation_date", to_date),
+        "Rekening tegenpartij": ("counterparty_account", to_str),
+        "Naam tegenpartij": ("counterparty_name", to_str),
+        "Mededeling": ("message", to_str),
     }
+    # Constructor arguments go in XlTransaction field order; fields the sheet lacks keep their default
+    fields = dataclasses.fields(XlTransaction)
+    positions = {field.name: pos for pos, field in enumerate(fields)}
+    defaults = [field.default for field in fields]
     col_actions = []
-    for (col, col_head) in enumerate(ws.columns):
+    for (col, col_head) in enumerate(header):
         try:
             field, xform = col_assq[col_head]
-
-            col_actions.append((col, lambda txn, value, f=field, xf=xform: setattr(txn, f, xf(value))))
+            col_actions.append((positions[field], col, xform))
         except KeyError:
             log.warning(f"Unknown column {col_head} in {fname}")
     xl_txns = []
-    nrows = len(ws)
-    for (i, row) in enumerate(ws.iter_rows(named=False)):
-        txn = XlTransaction()
-        for col, action in col_actions:
-            action(txn, row[col])
-        xl_txns.append(txn)
-    return xl_txns
\ No newline at end of file
+    for row in rows:
+        args = defaults.copy()
+        for pos, col, xform in col_actions:
+            args[pos] = xform(row[col])
+        xl_txns.append(XlTransaction(*args))
+    return xl_txns
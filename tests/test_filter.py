@@ -0,0 +1,45 @@
+import pytest
+import yaml
+
+# boekhouder.data and boekhouder.importer import each other; entering through importer resolves, like cmd.py does
+from boekhouder.importer import Filter
+from boekhouder.data import ConfigLoader, XlTransaction
+
+
+def make_filter(source: str) -> Filter:
+    return Filter(yaml.load(source, Loader=ConfigLoader))
+
+
+@pytest.mark.parametrize("source", [
+    'name: !regex "(?i)huur"',
+    'name: [!regex "(?i)huur", !regex "Verhuur"]',
+    'name: [!regex "Verhuur", !regex "(?i)huur"]',
+])
+def test_inline_flags(source):
+    f = make_filter(source)
+    assert f.test(XlTransaction(counterparty_name="HUURDER bv"))
+    assert not f.test(XlTransaction(counterparty_name="Alice"))
+
+
+def test_backreferences():
+    f = make_filter(r'message: [!regex "(a)\\1", !regex "(b)\\1"]')
+    assert f.test(XlTransaction(message="bb"))
+    assert not f.test(XlTransaction(message="ab"))
+
+
+def test_reused_group_names():
+    f = make_filter(r'message: [!regex "(?P<x>a)", !regex "(?P<x>b)"]')
+    assert f.test(XlTransaction(message="b"))
+
+
+def test_literals_and_regexes():
+    f = make_filter('kind: [Kaart, !regex "Overschrijving "]')
+    assert f.test(XlTransaction(description="Kaart"))
+    assert f.test(XlTransaction(description="Overschrijving naar X"))
+    assert not f.test(XlTransaction(description="Kaartbetaling"))
+
+
+def test_empty_fields_match_everything():
+    f = make_filter("message: lidgeld")
+    assert f.test(XlTransaction(message="lidgeld", counterparty_name="Alice", description="Kaart"))
+    assert not f.test(XlTransaction(message="huur"))
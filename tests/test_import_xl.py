@@ -0,0 +1,26 @@
+import os
+from datetime import date
+from decimal import Decimal
+
+# boekhouder.data and boekhouder.importer import each other; entering through importer resolves, like cmd.py does
+from boekhouder.importer import import_xl
+from boekhouder.data import XlTransaction
+
+EXTRACT = os.path.join(os.path.dirname(__file__), "data", "extract.xlsx")
+
+
+def test_import_xl():
+    # The sheet stores Referentie and Mededeling as numbers, Bedrag as a float and Boekdatum as a datetime
+    assert import_xl(EXTRACT) == [XlTransaction(
+        account="BE01 2345",
+        booking_date=date(2024, 1, 3),
+        value_date=date(2024, 1, 4),
+        operation_date=date(2024, 1, 2),
+        reference="20240001",
+        description="Overschrijving",
+        amount=Decimal("-12.10"),
+        currency="EUR",
+        counterparty_account="BE98 7654",
+        counterparty_name="HUURDER bv",
+        message="123456789",
+    )]